@@ -2,19 +2,46 @@ from flask import Flask, render_template, request, jsonify, session, redirect, u
 import os
 import json
 import logging
+import re
+import time
 import html
-from datetime import datetime, timedelta
+import heapq
+import bisect
+import math
+import threading
+from datetime import datetime, timedelta, date
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
+from concurrent.futures import ThreadPoolExecutor
+from jinja2 import Environment
+from markupsafe import Markup
 
 import gspread
 from google.oauth2.service_account import Credentials
 from gspread.utils import rowcol_to_a1
-import uuid
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from functools import wraps
+from collections import OrderedDict
+from werkzeug.security import generate_password_hash, check_password_hash
 import secrets
 
+# Optional C JSON encoders for the order Items cell; gspread needs a str either way.
+try:
+    import orjson
+
+    def dumps_json(value):
+        return orjson.dumps(value).decode('utf-8')
+except ImportError:
+    try:
+        import ujson as _json_encoder
+    except ImportError:
+        _json_encoder = json
+
+    def dumps_json(value):
+        return _json_encoder.dumps(value)
+
 # Production setup
 app = Flask(__name__)
 
@@ -67,11 +94,33 @@ logger = logging.getLogger(__name__)
 if not ADMIN_PASSWORD:
     logger.warning("ADMIN_PASSWORD not set. Admin login will be disabled until configured.")
 
+# Derive the admin hash once at startup; a pre-hashed Werkzeug value is used as-is.
+if not ADMIN_PASSWORD:
+    ADMIN_PASSWORD_HASH = None
+elif ADMIN_PASSWORD.startswith(('scrypt:', 'pbkdf2:')):
+    ADMIN_PASSWORD_HASH = ADMIN_PASSWORD
+else:
+    ADMIN_PASSWORD_HASH = generate_password_hash(ADMIN_PASSWORD)
+
 MAX_CART_ITEM_QUANTITY = 100
 ADMIN_LOGIN_MAX_ATTEMPTS = 5
 ADMIN_LOGIN_LOCKOUT_SECONDS = 300
 DEFAULT_PRODUCT_CACHE_TTL_SECONDS = 10
 DEFAULT_PRODUCT_FILTER_CACHE_MAX_ENTRIES = 40
+SHEETS_HTTP_POOL_CONNECTIONS = 10
+SHEETS_HTTP_POOL_MAXSIZE = 50
+SMTP_TIMEOUT_SECONDS = 30
+SMTP_NOOP_AFTER_IDLE_SECONDS = 60
+EMAIL_JOB_STATUS_TTL_SECONDS = 900
+VALID_PAYMENT_METHODS = frozenset({'Cash', 'Card', 'Digital'})
+VALID_PRINT_SIZES = frozenset({'80mm', '100mm', 'A4', 'A5', 'letter'})
+
+SECURITY_HEADERS = (
+    ('X-Content-Type-Options', 'nosniff'),
+    ('X-Frame-Options', 'SAMEORIGIN'),
+    ('Referrer-Policy', 'strict-origin-when-cross-origin'),
+    ('Permissions-Policy', 'camera=(), microphone=(), geolocation=()'),
+)
 
 app.config.update(
     JSON_SORT_KEYS=False,
@@ -79,6 +128,8 @@ app.config.update(
     SESSION_COOKIE_SAMESITE='Lax',
     SESSION_COOKIE_SECURE=bool(os.environ.get('RENDER') or os.getenv('SESSION_COOKIE_SECURE') == '1'),
     PERMANENT_SESSION_LIFETIME=timedelta(hours=8),
+    # Only sign and send the cookie when the session changes; the 8 hours then run from that change.
+    SESSION_REFRESH_EACH_REQUEST=False,
 )
 
 def require_admin(f):
@@ -92,15 +143,14 @@ def require_admin(f):
 
 @app.before_request
 def set_session_defaults():
-    session.permanent = True
+    if not session.permanent:
+        session.permanent = True
 
 
 @app.after_request
 def apply_security_headers(response):
-    response.headers['X-Content-Type-Options'] = 'nosniff'
-    response.headers['X-Frame-Options'] = 'SAMEORIGIN'
-    response.headers['Referrer-Policy'] = 'strict-origin-when-cross-origin'
-    response.headers['Permissions-Policy'] = 'camera=(), microphone=(), geolocation=()'
+    # No route sets these itself, so appending cannot create duplicates.
+    response.headers.extend(SECURITY_HEADERS)
     if request.path.startswith('/static/'):
         response.headers['Cache-Control'] = 'public, max-age=3600'
     elif request.path in ('/service-worker.js', '/manifest.webmanifest', '/offline'):
@@ -111,25 +161,40 @@ def apply_security_headers(response):
 
 
 def safe_float(value, default=0.0):
-    try:
-        if value == '' or value is None:
+    # Exact type checks keep already-numeric values off the string-cleaning path.
+    value_type = type(value)
+    if value_type is float:
+        # NaN/inf are never valid money or stock values ('nan'/'inf' parse as floats).
+        return value if math.isfinite(value) else default
+    if value_type is int:
+        return float(value)
+    if value is None or value == '':
+        return default
+    if value_type is str:
+        normalized = value.strip()
+        if not normalized:
             return default
-        if isinstance(value, str):
-            normalized = value.strip()
-            if not normalized:
-                return default
+        if ',' in normalized or '$' in normalized:
             normalized = normalized.replace(',', '').replace('$', '')
-            return float(normalized)
-        return float(value)
+        try:
+            parsed = float(normalized)
+        except ValueError:
+            return default
+        return parsed if math.isfinite(parsed) else default
+    try:
+        parsed = float(value)
     except (ValueError, TypeError):
         return default
+    return parsed if math.isfinite(parsed) else default
 
 def safe_int(value, default=0):
+    if type(value) is int:
+        return value
     try:
         if value == '' or value is None:
             return default
         return int(float(value))
-    except (ValueError, TypeError):
+    except (ValueError, TypeError, OverflowError):
         return default
 
 
@@ -151,6 +216,30 @@ def api_error(message, status_code=400, **extra):
     return jsonify(payload), status_code
 
 
+_MDY_DATETIME_RE = re.compile(r'^(\d{1,2})/(\d{1,2})/(\d{4})(?: (\d{1,2}):(\d{1,2}):(\d{1,2}))?$')
+_YMD_DATETIME_RE = re.compile(r'^(\d{4})-(\d{1,2})-(\d{1,2})(?: (\d{1,2}):(\d{1,2}):(\d{1,2}))?$')
+
+
+def utc_timestamp():
+    return datetime.utcnow().isoformat(timespec='seconds') + 'Z'
+
+
+def short_id():
+    # 8 upper-case hex chars from os.urandom(4).
+    return secrets.token_hex(4).upper()
+
+
+_order_day_stamp = (None, '')
+
+
+def order_day_stamp():
+    global _order_day_stamp
+    today = date.today()
+    if _order_day_stamp[0] != today:
+        _order_day_stamp = (today, today.strftime('%Y%m%d'))
+    return _order_day_stamp[1]
+
+
 def parse_order_datetime(value):
     if value in (None, ''):
         return None
@@ -166,53 +255,91 @@ def parse_order_datetime(value):
     except ValueError:
         pass
 
-    known_formats = (
-        "%Y-%m-%d %H:%M:%S",
-        "%Y-%m-%d",
-        "%m/%d/%Y %H:%M:%S",
-        "%m/%d/%Y",
-    )
-    for fmt in known_formats:
-        try:
-            return datetime.strptime(normalized, fmt)
-        except ValueError:
-            continue
-    return None
+    # fromisoformat needs zero-padded fields; these cover unpadded Y-M-D and US-style sheet dates.
+    match = _YMD_DATETIME_RE.match(normalized)
+    if match:
+        year, month, day, hour, minute, second = match.groups()
+    else:
+        match = _MDY_DATETIME_RE.match(normalized)
+        if not match:
+            return None
+        month, day, year, hour, minute, second = match.groups()
+    try:
+        return datetime(int(year), int(month), int(day), int(hour or 0), int(minute or 0), int(second or 0))
+    except ValueError:
+        return None
+
+
+def cart_line_total(unit_price, quantity):
+    # Work in whole cents, rounding half up (negatives too): no float drift to re-round later.
+    cents = unit_price * 100 + 0.5
+    if not math.isfinite(cents):
+        return 0.0
+    return math.floor(cents) * quantity / 100
+
+
+# Carts persist in the signed session cookie as compact [product_id, quantity, unit_price]
+# lines, so they survive restarts and work across worker processes. Names are rejoined from
+# the products cache when the cart is read.
+def _compact_cart(cart_items):
+    return [[item['product_id'], item['quantity'], item['unit_price']] for item in cart_items]
 
 
 def get_session_cart():
-    cart_items = session.get('cart', [])
-    if not isinstance(cart_items, list):
-        cart_items = []
+    stored_cart = session.get('cart', [])
+    cart_items = stored_cart if isinstance(stored_cart, list) else []
 
     sanitized_items = []
+    append = sanitized_items.append
+    to_float = safe_float
+    to_int = safe_int
     for item in cart_items:
-        if not isinstance(item, dict):
+        if isinstance(item, list):
+            # Compact cookie line: the name comes back from the products catalogue.
+            if len(item) < 3:
+                continue
+            product_id = str(item[0]).strip()
+            quantity = to_int(item[1], 0)
+            unit_price = to_float(item[2], 0.0)
+            product = sheets_manager.get_product_by_id(product_id) if product_id else None
+            name = product['Name'] if product else product_id
+        elif isinstance(item, dict):
+            # Carts from before compact cookies carry full dicts.
+            try:
+                product_id = str(item['product_id']).strip()
+                quantity = to_int(item['quantity'], 0)
+                unit_price = to_float(item['unit_price'], 0.0)
+                name = item['name']
+            except KeyError:
+                product_id = str(item.get('product_id', '')).strip()
+                quantity = to_int(item.get('quantity'), 0)
+                unit_price = to_float(item.get('unit_price'), 0.0)
+                name = item.get('name', '')
+        else:
             continue
 
-        quantity = safe_int(item.get('quantity'), 0)
-        unit_price = safe_float(item.get('unit_price'), 0.0)
-        product_id = str(item.get('product_id', '')).strip()
-
         if quantity <= 0 or not product_id:
             continue
 
-        sanitized_items.append({
+        append({
             'product_id': product_id,
-            'name': str(item.get('name', '')).strip(),
+            'name': str(name).strip(),
             'unit_price': unit_price,
             'quantity': quantity,
-            'total_price': round(unit_price * quantity, 2)
+            'total_price': cart_line_total(unit_price, quantity)
         })
 
-    session['cart'] = sanitized_items
-    session.modified = True
+    save_session_cart(sanitized_items)
     return sanitized_items
 
 
 def save_session_cart(cart_items):
-    session['cart'] = cart_items
-    session.modified = True
+    compact_lines = _compact_cart(cart_items)
+    if not compact_lines:
+        session.pop('cart', None)
+    elif session.get('cart') != compact_lines:
+        # Assign only on change so an unchanged cart leaves the session unmodified.
+        session['cart'] = compact_lines
 
 
 def is_admin_login_locked():
@@ -254,137 +381,73 @@ def validate_product_data(data):
     return True, ""
 
 
-def generate_invoice_html(order_data, company_info):
-    """Generate HTML invoice content with proper discount and delivery calculations"""
-
-    order_data = order_data if isinstance(order_data, dict) else {}
-    company_info = company_info if isinstance(company_info, dict) else {}
-
-    def esc(value):
-        return html.escape(str(value if value is not None else ""))
-
-    subtotal = safe_float(order_data.get('subtotal'), 0.0)
-    discount_amount = safe_float(order_data.get('discount_amount'), 0.0)
-    delivery_fee = safe_float(order_data.get('delivery_fee'), 0.0)
-    final_total = safe_float(order_data.get('total'), subtotal - discount_amount + delivery_fee)
-    payment_method = esc(order_data.get('payment_method', 'Cash'))
-    amount_received = safe_float(order_data.get('amount_received'), 0.0)
-    change = safe_float(order_data.get('change'), 0.0)
-
-    raw_date = str(order_data.get('date', '')).replace('Z', '+00:00')
-    try:
-        invoice_date = datetime.fromisoformat(raw_date) if raw_date else datetime.now()
-    except ValueError:
-        invoice_date = datetime.now()
-
-    safe_items = []
-    for item in order_data.get('items', []):
-        if not isinstance(item, dict):
-            continue
-        quantity = safe_int(item.get('quantity'), 0)
-        unit_price = safe_float(item.get('unit_price'), 0.0)
-        total_price = safe_float(item.get('total_price'), unit_price * quantity)
-        safe_items.append({
-            'name': esc(item.get('name', '')),
-            'quantity': quantity,
-            'unit_price': unit_price,
-            'total_price': total_price
-        })
-
-    items_html = ''.join(
-        f"""
-                <tr>
-                    <td>{item['name']}</td>
-                    <td class=\"text-right\">{item['quantity']}</td>
-                    <td class=\"text-right\">${item['unit_price']:.2f}</td>
-                    <td class=\"text-right\">${item['total_price']:.2f}</td>
-                </tr>
-                """
-        for item in safe_items
-    )
-
-    company_name = esc(company_info.get('name', 'POS System Store'))
-    company_address = esc(company_info.get('address', ''))
-    company_city = esc(company_info.get('city', ''))
-    company_phone = esc(company_info.get('phone', ''))
-    company_email = esc(company_info.get('email', ''))
-    company_website = esc(company_info.get('website', ''))
-    invoice_number = esc(order_data.get('invoice_number', 'N/A'))
-    order_id = esc(order_data.get('order_id', 'N/A'))
-    customer_name = esc(order_data.get('customer_name', 'Walk-in Customer'))
-    customer_phone = esc(order_data.get('customer_phone', ''))
-    customer_address = esc(order_data.get('customer_address', ''))
-
-    invoice_html = f"""
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <title>Invoice - {invoice_number}</title>
+# Static stylesheet kept as plain text and injected as a template global, outside the template parser.
+_INVOICE_CSS = """\
         <style>
-            body {{ 
+            body { 
                 font-family: Arial, sans-serif; 
                 margin: 0; 
                 padding: 20px; 
                 font-size: 12px;
                 color: #333;
-            }}
-            .invoice-header {{ 
+            }
+            .invoice-header { 
                 display: flex; 
                 justify-content: space-between; 
                 margin-bottom: 30px; 
                 border-bottom: 2px solid #333;
                 padding-bottom: 15px;
-            }}
-            .company-info h1 {{ 
+            }
+            .company-info h1 { 
                 margin: 0 0 10px 0; 
                 font-size: 24px;
                 color: #2c3e50;
-            }}
-            .company-info p {{ margin: 2px 0; }}
-            .invoice-details {{ text-align: right; }}
-            .invoice-details h2 {{ 
+            }
+            .company-info p { margin: 2px 0; }
+            .invoice-details { text-align: right; }
+            .invoice-details h2 { 
                 margin: 0 0 10px 0; 
                 font-size: 28px;
                 color: #e74c3c;
-            }}
-            .customer-info {{ 
+            }
+            .customer-info { 
                 margin-bottom: 30px; 
                 padding: 15px;
                 background-color: #f8f9fa;
                 border-left: 4px solid #007bff;
-            }}
-            .customer-info h3 {{ 
+            }
+            .customer-info h3 { 
                 margin: 0 0 10px 0; 
                 color: #007bff;
-            }}
-            table {{ 
+            }
+            table { 
                 width: 100%; 
                 border-collapse: collapse; 
                 margin-bottom: 30px;
-            }}
-            th, td {{ 
+            }
+            th, td { 
                 padding: 12px; 
                 text-align: left; 
                 border-bottom: 1px solid #ddd; 
-            }}
-            th {{ 
+            }
+            th { 
                 background-color: #f8f9fa; 
                 font-weight: bold;
                 color: #495057;
-            }}
-            .text-right {{ text-align: right; }}
-            .invoice-summary {{ 
+            }
+            .text-right { text-align: right; }
+            .invoice-summary { 
                 float: right; 
                 width: 300px; 
                 margin-top: 20px;
-            }}
-            .summary-row {{ 
+            }
+            .summary-row { 
                 display: flex; 
                 justify-content: space-between; 
                 padding: 8px 0;
                 border-bottom: 1px solid #eee;
-            }}
-            .total-row {{ 
+            }
+            .total-row { 
                 font-weight: bold; 
                 font-size: 16px;
                 border-top: 2px solid #333;
@@ -392,60 +455,71 @@ def generate_invoice_html(order_data, company_info):
                 background-color: #f8f9fa;
                 padding: 15px 0;
                 margin-top: 10px;
-            }}
-            .discount-row {{
+            }
+            .discount-row {
                 color: #28a745;
                 font-weight: bold;
-            }}
-            .delivery-row {{
+            }
+            .delivery-row {
                 color: #17a2b8;
                 font-weight: bold;
-            }}
-            .payment-info {{
+            }
+            .payment-info {
                 margin-top: 15px;
                 padding-top: 15px;
                 border-top: 1px solid #ddd;
-            }}
-            .footer {{ 
+            }
+            .footer { 
                 text-align: center; 
                 margin-top: 50px; 
                 padding-top: 20px;
                 border-top: 1px solid #ddd;
                 color: #666;
-            }}
-            .payment-method {{
+            }
+            .payment-method {
                 clear: both;
                 margin-top: 30px;
                 padding: 15px;
                 background-color: #e9ecef;
                 border-radius: 5px;
                 border-left: 4px solid #28a745;
-            }}
-        </style>
+            }
+        </style>"""
+
+INVOICE_TEMPLATE_SRC = """
+    <!DOCTYPE html>
+    <html>
+    <head>
+        <title>Invoice - {{ invoice_number }}</title>
+        {{ invoice_css }}
     </head>
     <body>
         <div class="invoice-header">
             <div class="company-info">
-                <h1>{company_name}</h1>
-                <p>{company_address}</p>
-                <p>{company_city}</p>
-                <p>Phone: {company_phone}</p>
-                <p>Email: {company_email}</p>
+                <h1>{{ company_name }}</h1>
+                <p>{{ company_address }}</p>
+                <p>{{ company_city }}</p>
+                <p>Phone: {{ company_phone }}</p>
+                <p>Email: {{ company_email }}</p>
             </div>
             <div class="invoice-details">
                 <h2>INVOICE</h2>
-                <p><strong>Invoice #:</strong> {invoice_number}</p>
-                <p><strong>Order ID:</strong> {order_id}</p>
-                <p><strong>Date:</strong> {invoice_date.strftime('%Y-%m-%d')}</p>
-                <p><strong>Time:</strong> {invoice_date.strftime('%H:%M:%S')}</p>
+                <p><strong>Invoice #:</strong> {{ invoice_number }}</p>
+                <p><strong>Order ID:</strong> {{ order_id }}</p>
+                <p><strong>Date:</strong> {{ invoice_date.strftime('%Y-%m-%d') }}</p>
+                <p><strong>Time:</strong> {{ invoice_date.strftime('%H:%M:%S') }}</p>
             </div>
         </div>
 
         <div class="customer-info">
             <h3>Bill To:</h3>
-            <p><strong>{customer_name}</strong></p>
-            {f"<p>Phone: {customer_phone}</p>" if customer_phone else ''}
-            {f"<p>Address: {customer_address}</p>" if customer_address else ''}
+            <p><strong>{{ customer_name }}</strong></p>
+            {% if customer_phone %}
+            <p>Phone: {{ customer_phone }}</p>
+            {% endif %}
+            {% if customer_address %}
+            <p>Address: {{ customer_address }}</p>
+            {% endif %}
         </div>
 
         <table>
@@ -458,63 +532,275 @@ def generate_invoice_html(order_data, company_info):
                 </tr>
             </thead>
             <tbody>
-                {items_html}
+                {{ items_html }}
             </tbody>
         </table>
 
         <div class="invoice-summary">
             <div class="summary-row">
                 <span>Subtotal:</span>
-                <span>${subtotal:.2f}</span>
-            </div>
-            {f'''
-            <div class="summary-row discount-row">
-                <span>Discount:</span>
-                <span>-${discount_amount:.2f}</span>
+                <span>${{ '%.2f'|format(subtotal) }}</span>
             </div>
-            ''' if discount_amount > 0 else ''}
-            {f'''
-            <div class="summary-row delivery-row">
-                <span>Delivery Fee:</span>
-                <span>${delivery_fee:.2f}</span>
-            </div>
-            ''' if delivery_fee > 0 else ''}
+            {{ discount_block }}
+            {{ delivery_block }}
             <div class="summary-row">
                 <span>Tax (0%):</span>
                 <span>$0.00</span>
             </div>
             <div class="summary-row total-row">
                 <span>FINAL TOTAL:</span>
-                <span>${final_total:.2f}</span>
-            </div>
-            {f'''
-            <div class="payment-info">
-                <div class="summary-row">
-                    <span>Amount Received:</span>
-                    <span>${amount_received:.2f}</span>
-                </div>
-                <div class="summary-row">
-                    <span>Change:</span>
-                    <span>${change:.2f}</span>
-                </div>
+                <span>${{ '%.2f'|format(final_total) }}</span>
             </div>
-            ''' if payment_method == 'Cash' else ''}
+            {{ payment_block }}
         </div>
 
         <div class="payment-method">
-            <p><strong>Payment Method:</strong> {payment_method}</p>
+            <p><strong>Payment Method:</strong> {{ payment_method }}</p>
         </div>
 
         <div class="footer">
             <p><strong>Thank you for your business!</strong></p>
-            <p>Questions? Contact us at {company_phone} or {company_email}</p>
-            <p>Website: {company_website}</p>
+            <p>Questions? Contact us at {{ company_phone }} or {{ company_email }}</p>
+            <p>Website: {{ company_website }}</p>
         </div>
     </body>
     </html>
     """
-    
-    return invoice_html
+
+def _esc(value):
+    return html.escape('' if value is None else str(value))
+
+
+_INVOICE_ROW = (
+    '<tr><td>%s</td><td class="text-right">%d</td>'
+    '<td class="text-right">$%.2f</td><td class="text-right">$%.2f</td></tr>'
+)
+
+_INVOICE_DISCOUNT_BLOCK = '<div class="summary-row discount-row"><span>Discount:</span><span>-$%.2f</span></div>'
+_INVOICE_DELIVERY_BLOCK = '<div class="summary-row delivery-row"><span>Delivery Fee:</span><span>$%.2f</span></div>'
+_INVOICE_PAYMENT_BLOCK = (
+    '<div class="payment-info">'
+    '<div class="summary-row"><span>Amount Received:</span><span>$%.2f</span></div>'
+    '<div class="summary-row"><span>Change:</span><span>$%.2f</span></div>'
+    '</div>'
+)
+
+# Compiled once at import; autoescape covers every interpolated value.
+_INVOICE_TMPL = Environment(autoescape=True, trim_blocks=True, lstrip_blocks=True).from_string(
+    INVOICE_TEMPLATE_SRC,
+    globals={'invoice_css': Markup(_INVOICE_CSS)}
+)
+
+
+def generate_invoice_html(order_data, company_info):
+    """Generate HTML invoice content with proper discount and delivery calculations"""
+
+    order_data = order_data if isinstance(order_data, dict) else {}
+    company_info = company_info if isinstance(company_info, dict) else {}
+
+    def text(value):
+        return str(value if value is not None else "")
+
+    subtotal = safe_float(order_data.get('subtotal'), 0.0)
+    discount_amount = safe_float(order_data.get('discount_amount'), 0.0)
+    delivery_fee = safe_float(order_data.get('delivery_fee'), 0.0)
+
+    raw_date = str(order_data.get('date', '')).replace('Z', '+00:00')
+    try:
+        invoice_date = datetime.fromisoformat(raw_date) if raw_date else datetime.now()
+    except ValueError:
+        invoice_date = datetime.now()
+
+    safe_items = []
+    for item in order_data.get('items', []):
+        if not isinstance(item, dict):
+            continue
+        quantity = safe_int(item.get('quantity'), 0)
+        unit_price = safe_float(item.get('unit_price'), 0.0)
+        total_price = safe_float(item.get('total_price'), unit_price * quantity)
+        safe_items.append((_esc(item.get('name', '')), quantity, unit_price, total_price))
+
+    # Item rows and optional summary blocks are pre-formatted here rather than branched in the template.
+    items_html = Markup(''.join([_INVOICE_ROW % item for item in safe_items]))
+
+    payment_method = text(order_data.get('payment_method', 'Cash'))
+    discount_block = _INVOICE_DISCOUNT_BLOCK % discount_amount if discount_amount > 0 else ''
+    delivery_block = _INVOICE_DELIVERY_BLOCK % delivery_fee if delivery_fee > 0 else ''
+    payment_block = ''
+    if payment_method == 'Cash':
+        payment_block = _INVOICE_PAYMENT_BLOCK % (
+            safe_float(order_data.get('amount_received'), 0.0),
+            safe_float(order_data.get('change'), 0.0)
+        )
+
+    return _INVOICE_TMPL.render(
+        items_html=items_html,
+        subtotal=subtotal,
+        discount_block=Markup(discount_block),
+        delivery_block=Markup(delivery_block),
+        payment_block=Markup(payment_block),
+        final_total=safe_float(order_data.get('total'), subtotal - discount_amount + delivery_fee),
+        payment_method=payment_method,
+        invoice_date=invoice_date,
+        company_name=text(company_info.get('name', 'POS System Store')),
+        company_address=text(company_info.get('address', '')),
+        company_city=text(company_info.get('city', '')),
+        company_phone=text(company_info.get('phone', '')),
+        company_email=text(company_info.get('email', '')),
+        company_website=text(company_info.get('website', '')),
+        invoice_number=text(order_data.get('invoice_number', 'N/A')),
+        order_id=text(order_data.get('order_id', 'N/A')),
+        customer_name=text(order_data.get('customer_name', 'Walk-in Customer')),
+        customer_phone=text(order_data.get('customer_phone', '')),
+        customer_address=text(order_data.get('customer_address', '')),
+    )
+
+
+# Invoice mail goes out on a small worker pool over one reused, authenticated SMTP session.
+_email_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='invoice-mail')
+_smtp_lock = threading.Lock()
+_smtp_connection = None
+_smtp_last_used = 0.0
+# job_id -> {'status': 'queued' | 'sent' | 'failed', 'updated_at': monotonic}; pruned by age.
+# Kept per process: with several gunicorn workers a status poll can miss the job (404 = unknown).
+_email_jobs = OrderedDict()
+_email_jobs_lock = threading.Lock()
+
+
+def _set_email_job_status(job_id, status):
+    now = time.monotonic()
+    with _email_jobs_lock:
+        _email_jobs.pop(job_id, None)
+        _email_jobs[job_id] = {'status': status, 'updated_at': now}
+        while _email_jobs:
+            oldest_id, oldest = next(iter(_email_jobs.items()))
+            if now - oldest['updated_at'] <= EMAIL_JOB_STATUS_TTL_SECONDS:
+                break
+            _email_jobs.pop(oldest_id)
+
+
+def get_email_job_status(job_id):
+    with _email_jobs_lock:
+        job = _email_jobs.get(job_id)
+        return job['status'] if job else None
+
+
+def _close_smtp_connection():
+    # Caller holds _smtp_lock.
+    global _smtp_connection
+    if _smtp_connection is not None:
+        try:
+            _smtp_connection.quit()
+        except (smtplib.SMTPException, OSError):
+            pass
+        _smtp_connection = None
+
+
+def _get_smtp_connection():
+    # Caller holds _smtp_lock.
+    global _smtp_connection
+    if _smtp_connection is not None and time.monotonic() - _smtp_last_used > SMTP_NOOP_AFTER_IDLE_SECONDS:
+        try:
+            if _smtp_connection.noop()[0] != 250:
+                _close_smtp_connection()
+        except (smtplib.SMTPException, OSError):
+            _smtp_connection.close()
+            _smtp_connection = None
+
+    if _smtp_connection is None:
+        server = smtplib.SMTP(SMTP_SERVER, SMTP_PORT, timeout=SMTP_TIMEOUT_SECONDS)
+        try:
+            server.starttls()
+            server.login(EMAIL_ADDRESS, EMAIL_PASSWORD)
+        except Exception:
+            server.close()
+            raise
+        _smtp_connection = server
+    return _smtp_connection
+
+
+def _send_email(msg, recipient_email):
+    global _smtp_connection, _smtp_last_used
+    text = msg.as_string()
+    with _smtp_lock:
+        for attempt in range(2):
+            try:
+                _get_smtp_connection().sendmail(EMAIL_ADDRESS, recipient_email, text)
+                _smtp_last_used = time.monotonic()
+                return
+            except smtplib.SMTPServerDisconnected:
+                # The server dropped the idle session; reconnect once and retry.
+                if _smtp_connection is not None:
+                    _smtp_connection.close()
+                _smtp_connection = None
+                if attempt:
+                    raise
+            except Exception:
+                _close_smtp_connection()
+                raise
+
+
+def _send_invoice_email(job_id, recipient_email, subject, message_body, order_data, company_info):
+    try:
+        safe_message_body = html.escape(message_body)
+        invoice_html = generate_invoice_html(order_data, company_info)
+
+        msg = MIMEMultipart('alternative')
+        msg['From'] = EMAIL_ADDRESS
+        msg['To'] = recipient_email
+        msg['Subject'] = subject
+
+        # Create text and HTML parts
+        text_part = MIMEText(message_body, 'plain')
+        html_part = MIMEText(f"""
+        <html>
+        <body>
+            <p>{safe_message_body.replace(chr(10), '<br>')}</p>
+            <hr>
+            {invoice_html}
+        </body>
+        </html>
+        """, 'html')
+
+        msg.attach(text_part)
+        msg.attach(html_part)
+
+        _send_email(msg, recipient_email)
+        _set_email_job_status(job_id, 'sent')
+        logger.info(f"Invoice emailed to {recipient_email}")
+    except Exception as e:
+        _set_email_job_status(job_id, 'failed')
+        logger.error(f"Error sending email: {e}")
+
+
+class InsufficientStockError(Exception):
+    """Live stock is below an order's quantity; raised before the order is written."""
+
+    def __init__(self, product_id, product_name, available, requested):
+        super().__init__(f"Insufficient stock for {product_name}: {available} available, {requested} requested")
+        self.product_id = product_id
+        self.product_name = product_name
+        self.available = available
+        self.requested = requested
+
+
+# Products sheet header -> value for a new row; unknown headers get a blank cell.
+_PRODUCT_COL_EXTRACTORS = {
+    'ID': lambda d: d.get('ID', ''),
+    'Name': lambda d: d.get('Name', ''),
+    'Price': lambda d: d.get('Price', 0),
+    'Stock': lambda d: d.get('Stock', 0),
+    'Category': lambda d: d.get('Category', ''),
+    'Description': lambda d: d.get('Description', ''),
+    'Created_At': lambda d: d.get('Created_At', ''),
+    'Updated_At': lambda d: d.get('Updated_At', ''),
+    'Import_Price': lambda d: d.get('Import_Price', 0),
+    'Import Price': lambda d: d.get('Import_Price', 0),
+}
+
+
+def _blank_column(product_data):
+    return ''
 
 
 class GoogleSheetsManager:
@@ -523,9 +809,24 @@ class GoogleSheetsManager:
         self.spreadsheet_name = spreadsheet_name
         self.client = None
         self.spreadsheet = None
-        self._products_cache = []
+        self._worksheets = {}
+        self._products_cache = ()
+        self._products_by_id = {}
+        self._product_rows = {}
+        self._product_positions = {}
+        self._products_search_index = ()
+        self._products_by_category = {}
+        self._products_stock_index = []
+        self._products_columns = {}
+        self._products_headers = []
         self._products_cache_at = None
+        self._products_cache_expires_at = 0.0
         self._filtered_products_cache = {}
+        self._orders_cache = ()
+        self._orders_dates = ()
+        self._orders_cache_expires_at = 0.0
+        self._cache_modified_times = {}
+        self._loaded_sheets = set()
         self.connect()
     
     def connect(self):
@@ -536,6 +837,7 @@ class GoogleSheetsManager:
             ]
             creds = Credentials.from_service_account_file(self.credentials_file, scopes=scope)
             self.client = gspread.authorize(creds)
+            self._configure_http_session()
             
             try:
                 self.spreadsheet = self.client.open(self.spreadsheet_name)
@@ -544,70 +846,270 @@ class GoogleSheetsManager:
                 self.spreadsheet = self.client.create(self.spreadsheet_name)
                 logger.info(f"Created new spreadsheet: {self.spreadsheet_name}")
             
+            self._worksheets = {}
             self.setup_worksheets()
             self.invalidate_products_cache()
+            self.invalidate_orders_cache()
         except Exception as e:
             logger.error(f"Error connecting to Google Sheets: {e}")
 
+    def _configure_http_session(self):
+        http_client = getattr(self.client, 'http_client', self.client)
+        http_session = getattr(http_client, 'session', None)
+        if http_session is None:
+            return
+
+        # Reuse pooled keep-alive connections instead of a fresh TLS handshake per Sheets call.
+        adapter = HTTPAdapter(
+            pool_connections=SHEETS_HTTP_POOL_CONNECTIONS,
+            pool_maxsize=SHEETS_HTTP_POOL_MAXSIZE,
+            max_retries=Retry(total=3, backoff_factor=0.2, status_forcelist=[429, 500, 502, 503, 504])
+        )
+        http_session.mount('https://', adapter)
+        http_session.mount('http://', adapter)
+        http_session.headers.update({'Connection': 'keep-alive'})
+
+    def _ws(self, name):
+        worksheet = self._worksheets.get(name)
+        if worksheet is None:
+            worksheet = self.spreadsheet.worksheet(name)
+            self._worksheets[name] = worksheet
+        return worksheet
+
     def invalidate_products_cache(self):
-        self._products_cache = []
+        self._products_cache = ()
+        self._products_by_id = {}
+        self._product_rows = {}
+        self._product_positions = {}
+        self._products_search_index = ()
+        self._products_by_category = {}
+        self._products_stock_index = []
+        self._products_columns = {}
+        self._products_headers = []
         self._products_cache_at = None
+        self._products_cache_expires_at = 0.0
         self._filtered_products_cache = {}
+        self._cache_modified_times.pop('Products', None)
+
+    def invalidate_orders_cache(self):
+        self._orders_cache = ()
+        self._orders_dates = ()
+        self._orders_cache_expires_at = 0.0
+        self._cache_modified_times.pop('Orders', None)
+
+    def _orders_cache_valid(self):
+        return time.monotonic() < self._orders_cache_expires_at
 
     def _prune_filtered_products_cache(self):
         while len(self._filtered_products_cache) > PRODUCT_FILTER_CACHE_MAX_ENTRIES:
             self._filtered_products_cache.pop(next(iter(self._filtered_products_cache)), None)
 
     def _products_cache_valid(self):
-        if self._products_cache_at is None:
-            return False
-        age_seconds = (datetime.utcnow() - self._products_cache_at).total_seconds()
-        return age_seconds <= PRODUCT_CACHE_TTL_SECONDS
+        return time.monotonic() < self._products_cache_expires_at
 
     @staticmethod
-    def _find_column_index(headers, candidates):
-        normalized_candidates = {str(candidate).strip().lower() for candidate in candidates}
+    def _header_index(headers):
+        header_idx = {}
         for idx, header in enumerate(headers, start=1):
-            if str(header).strip().lower() in normalized_candidates:
+            header_idx.setdefault(str(header).strip().lower(), idx)
+        return header_idx
+
+    @staticmethod
+    def _lookup_column(header_idx, *names):
+        for name in names:
+            idx = header_idx.get(name.lower())
+            if idx:
                 return idx
         return None
 
-    def _get_products_columns(self, worksheet):
-        headers = [str(h).strip() for h in worksheet.row_values(1)]
+    @classmethod
+    def _products_columns_for(cls, headers):
         if not headers:
-            return {}, []
+            return {}
+
+        header_idx = cls._header_index(headers)
+
+        def col(*names):
+            return cls._lookup_column(header_idx, *names)
 
         columns = {
-            'id': self._find_column_index(headers, ('ID',)),
-            'name': self._find_column_index(headers, ('Name',)),
-            'price': self._find_column_index(headers, ('Price',)),
-            'stock': self._find_column_index(headers, ('Stock',)),
-            'category': self._find_column_index(headers, ('Category',)),
-            'description': self._find_column_index(headers, ('Description',)),
-            'created_at': self._find_column_index(headers, ('Created_At',)),
-            'updated_at': self._find_column_index(headers, ('Updated_At',)),
-            'import_price': self._find_column_index(headers, ('Import_Price', 'Import Price')),
+            'id': col('ID'),
+            'name': col('Name'),
+            'price': col('Price'),
+            'stock': col('Stock'),
+            'category': col('Category'),
+            'description': col('Description'),
+            'created_at': col('Created_At'),
+            'updated_at': col('Updated_At'),
+            'import_price': col('Import_Price', 'Import Price'),
         }
-        return columns, headers
+        return columns
 
-    @staticmethod
-    def _batch_update_cells(worksheet, updates):
-        if not updates:
+    def _cached_columns(self):
+        self.get_products()
+        return self._products_columns, self._products_headers
+
+    def _cached_row_index(self):
+        self.get_products()
+        return self._product_rows
+
+    def _patch_cached_product(self, product_id, changes):
+        # Apply a successful write to the cache instead of dropping it. Copy-on-write:
+        # the patched record replaces the old one, so dicts already handed out never change.
+        position = self._product_positions.get(product_id)
+        if position is None:
             return
-        payload = [
-            {'range': rowcol_to_a1(row, col), 'values': [[value]]}
-            for row, col, value in updates
-        ]
-        worksheet.batch_update(payload, value_input_option='RAW')
+        previous = self._products_cache[position]
+        product = dict(previous)
+        product.update(changes)
+        products = list(self._products_cache)
+        products[position] = product
+        self._products_cache = tuple(products)
+        self._products_by_id[product_id] = product
+        if 'Name' in changes or 'Category' in changes or 'Description' in changes:
+            self._build_products_search_index()
+        if product['Stock'] != previous['Stock']:
+            self._move_stock_index_entry(position, previous['Stock'], product['Stock'])
+        self._filtered_products_cache = {}
+
+    def _build_products_stock_index(self):
+        # Sorted (stock, position) pairs, so a threshold query is one bisect.
+        self._products_stock_index = sorted(
+            (product['Stock'], position) for position, product in enumerate(self._products_cache)
+        )
+
+    def _move_stock_index_entry(self, position, old_stock, new_stock):
+        # Incremental update for one patched product: O(log n) search plus a list shift.
+        index = self._products_stock_index
+        idx = bisect.bisect_left(index, (old_stock, position))
+        if idx < len(index) and index[idx] == (old_stock, position):
+            del index[idx]
+        bisect.insort(index, (new_stock, position))
+
+    def _build_products_search_index(self):
+        # Lower-cased text per product, parallel to _products_cache, plus category -> positions.
+        search_index = []
+        by_category = {}
+        for position, product in enumerate(self._products_cache):
+            name_lc = str(product.get('Name', '')).lower()
+            category = str(product.get('Category', 'General'))
+            category_lc = category.lower()
+            description_lc = str(product.get('Description', '')).lower()
+            search_index.append((name_lc, category_lc, description_lc, f"{name_lc} {category_lc} {description_lc}"))
+            by_category.setdefault(category_lc, []).append(position)
+        self._products_search_index = tuple(search_index)
+        self._products_by_category = {key: tuple(items) for key, items in by_category.items()}
 
     @staticmethod
-    def _build_row_lookup(values):
-        lookup = {}
-        for row_idx, raw in enumerate(values[1:], start=2):
-            key = str(raw).strip()
-            if key:
-                lookup[key] = row_idx
-        return lookup
+    def _cell_data(value):
+        if isinstance(value, bool):
+            return {'userEnteredValue': {'boolValue': value}}
+        if isinstance(value, (int, float)):
+            return {'userEnteredValue': {'numberValue': value}}
+        return {'userEnteredValue': {'stringValue': '' if value is None else str(value)}}
+
+    def _apply_mutations(self, writes=(), appends=()):
+        """Send cell writes and row appends as one spreadsheets.batchUpdate request.
+
+        writes: (sheet_name, row, col, value) tuples; appends: (sheet_name, row_values) tuples.
+        """
+        requests_body = []
+        for sheet_name, row, col, value in writes:
+            requests_body.append({'updateCells': {
+                'start': {'sheetId': self._ws(sheet_name).id, 'rowIndex': row - 1, 'columnIndex': col - 1},
+                'rows': [{'values': [self._cell_data(value)]}],
+                'fields': 'userEnteredValue'
+            }})
+
+        rows_by_sheet = {}
+        for sheet_name, row_values in appends:
+            rows_by_sheet.setdefault(sheet_name, []).append(
+                {'values': [self._cell_data(value) for value in row_values]}
+            )
+        for sheet_name, rows in rows_by_sheet.items():
+            requests_body.append({'appendCells': {
+                'sheetId': self._ws(sheet_name).id,
+                'rows': rows,
+                'fields': 'userEnteredValue'
+            }})
+
+        if requests_body:
+            self.spreadsheet.batch_update({'requests': requests_body})
+
+    @staticmethod
+    def _column_range(sheet_name, col, start_row=1):
+        column_letter = rowcol_to_a1(1, col)[:-1]
+        return f"{sheet_name}!{column_letter}{start_row}:{column_letter}"
+
+    def _batch_get_columns(self, ranges):
+        # Column-major, unformatted values: one flat list of raw cells per single-column range.
+        response = self.spreadsheet.values_batch_get(ranges, params={
+            'majorDimension': 'COLUMNS',
+            'valueRenderOption': 'UNFORMATTED_VALUE'
+        })
+        value_ranges = response.get('valueRanges', [])
+        columns = []
+        for idx in range(len(ranges)):
+            values = value_ranges[idx].get('values', []) if idx < len(value_ranges) else []
+            columns.append(values[0] if values else [])
+        return columns
+
+    @staticmethod
+    def _inventory_log_row(product_id, action, quantity_change, previous_stock, new_stock, reason, timestamp=None):
+        return [
+            short_id(),
+            product_id,
+            action,
+            quantity_change,
+            previous_stock,
+            new_stock,
+            timestamp or utc_timestamp(),
+            reason
+        ]
+
+    def _expire_products_cache(self):
+        # Keep the snapshot for in-flight patches, but force a reload on the next read
+        # even if Drive's modifiedTime has not moved yet.
+        self._products_cache_expires_at = 0.0
+        self._cache_modified_times.pop('Products', None)
+
+    def _resolve_live_rows(self, product_ids, id_values):
+        # The Products sheet is edited by hand, so a cached row number is trusted only while the
+        # live ID column (read from row 2) still holds that product; otherwise the fetched IDs decide.
+        cached_rows = self._product_rows
+        rows = {}
+        live_rows = None
+        for product_id in product_ids:
+            row_idx = cached_rows.get(product_id)
+            if row_idx is None or row_idx - 2 >= len(id_values) or str(id_values[row_idx - 2]).strip() != product_id:
+                if live_rows is None:
+                    live_rows = {str(value).strip(): row_number for row_number, value in enumerate(id_values, start=2)}
+                    self._expire_products_cache()
+                row_idx = live_rows.get(product_id)
+            if row_idx is not None:
+                rows[product_id] = row_idx
+        return rows
+
+    def _locate_product_row(self, product_id, id_col, value_col=None):
+        """Cached row of a product, confirmed by reading its live ID cell.
+
+        The value_col cell of the same row comes back from the same batchGet. If
+        the ID no longer matches, the cache is reloaded and the lookup retried once.
+        Returns (None, None) when the product cannot be found.
+        """
+        for _ in range(2):
+            row_idx = self._cached_row_index().get(product_id)
+            if row_idx is None:
+                return None, None
+            ranges = [f"Products!{rowcol_to_a1(row_idx, id_col)}"]
+            if value_col is not None:
+                ranges.append(f"Products!{rowcol_to_a1(row_idx, value_col)}")
+            cells = self._batch_get_columns(ranges)
+            if cells[0] and str(cells[0][0]).strip() == product_id:
+                value = cells[1][0] if value_col is not None and cells[1] else None
+                return row_idx, value
+            self.invalidate_products_cache()
+        return None, None
     
     def setup_worksheets(self):
         worksheets_config = {
@@ -619,11 +1121,13 @@ class GoogleSheetsManager:
         
         for sheet_name, headers in worksheets_config.items():
             try:
-                worksheet = self.spreadsheet.worksheet(sheet_name)
+                worksheet = self._ws(sheet_name)
                 # Check if we need to add new columns for existing sheets
                 if sheet_name == 'Products':
                     existing_headers = [str(h).strip() for h in worksheet.row_values(1)]
-                    import_price_col = self._find_column_index(existing_headers, ('Import_Price', 'Import Price'))
+                    import_price_col = self._lookup_column(
+                        self._header_index(existing_headers), 'Import_Price', 'Import Price'
+                    )
                     if import_price_col is None:
                         worksheet.update_cell(1, len(existing_headers) + 1, 'Import_Price')
                         logger.info("Added Import_Price column to existing Products worksheet")
@@ -641,147 +1145,220 @@ class GoogleSheetsManager:
                             logger.info(f"Added {col} column to existing Orders worksheet")
             except gspread.WorksheetNotFound:
                 worksheet = self.spreadsheet.add_worksheet(title=sheet_name, rows=1000, cols=len(headers))
+                self._worksheets[sheet_name] = worksheet
                 worksheet.append_row(headers)
                 logger.info(f"Created worksheet: {sheet_name}")
 
     def add_order(self, order_data: dict):
-        try:
-            orders_worksheet = self.spreadsheet.worksheet('Orders')
-            order_row = [
-                order_data.get('Order_ID', ''),
-                order_data.get('Customer_Name', ''),
-                order_data.get('Customer_Phone', ''),
-                order_data.get('Customer_Address', ''),
-                json.dumps(order_data.get('Items', [])),
-                order_data.get('Subtotal', 0),  # Add subtotal
-                order_data.get('Discount_Amount', 0),  # Add discount
-                order_data.get('Delivery_Fee', 0),  # Add delivery fee
-                order_data.get('Total_Amount', 0),
-                order_data.get('Status', 'Completed'),
-                order_data.get('Order_Date', datetime.now().isoformat()),
-                order_data.get('Payment_Method', 'Cash'),
-                order_data.get('Amount_Received', 0)
-            ]
+        """Append the order and deduct its stock.
 
-            orders_worksheet.append_row(order_row)
+        Live stock is checked before anything is written; a shortfall raises
+        InsufficientStockError instead of recording an oversold order.
+        """
+        try:
+            now_iso = utc_timestamp()
 
             # Batch stock deductions to minimize Google Sheets API calls.
-            products = self.get_products(force_refresh=True)
-            product_map = {p['ID']: p for p in products}
             quantity_by_product = {}
             for item in order_data.get('Items', []):
-                product_id = str(item.get('product_id', '')).strip()
-                quantity = safe_int(item.get('quantity'), 0)
+                if isinstance(item, dict):
+                    product_id = str(item.get('product_id', '')).strip()
+                    quantity = safe_int(item.get('quantity'), 0)
+                else:
+                    # Compact [product_id, quantity, unit_price, name] line from checkout.
+                    product_id = str(item[0]).strip()
+                    quantity = safe_int(item[1], 0)
                 if not product_id or quantity <= 0:
                     continue
                 quantity_by_product[product_id] = quantity_by_product.get(product_id, 0) + quantity
 
+            writes = []
+            inventory_logs = []
+            patches = {}
             if quantity_by_product:
-                products_worksheet = self.spreadsheet.worksheet('Products')
-                columns, _ = self._get_products_columns(products_worksheet)
+                columns, _ = self._cached_columns()
                 id_col = columns.get('id')
                 stock_col = columns.get('stock')
                 updated_at_col = columns.get('updated_at')
                 if id_col and stock_col:
-                    id_values = products_worksheet.col_values(id_col)
-                    row_lookup = self._build_row_lookup(id_values)
-                    timestamp = datetime.now().isoformat()
-
-                    stock_updates = []
-                    inventory_logs = []
+                    # Live ID and Stock columns in one batchGet; the IDs confirm the cached row numbers.
+                    id_values, stock_values = self._batch_get_columns([
+                        self._column_range('Products', id_col, start_row=2),
+                        self._column_range('Products', stock_col, start_row=2)
+                    ])
+                    row_lookup = self._resolve_live_rows(quantity_by_product, id_values)
 
                     for product_id, quantity in quantity_by_product.items():
-                        product = product_map.get(product_id)
                         row_idx = row_lookup.get(product_id)
-                        if not product or row_idx is None:
+                        if row_idx is None:
                             continue
 
-                        previous_stock = max(0, safe_int(product.get('Stock'), 0))
-                        new_stock = max(0, previous_stock - quantity)
-
-                        stock_updates.append((row_idx, stock_col, new_stock))
+                        raw_stock = stock_values[row_idx - 2] if row_idx - 2 < len(stock_values) else ''
+                        previous_stock = max(0, safe_int(raw_stock, 0))
+                        if previous_stock < quantity:
+                            # The caller validated against a stale snapshot; bring it up to date.
+                            self._patch_cached_product(product_id, {'Stock': previous_stock})
+                            product = self._products_by_id.get(product_id)
+                            raise InsufficientStockError(
+                                product_id, product['Name'] if product else product_id, previous_stock, quantity
+                            )
+                        new_stock = previous_stock - quantity
+
+                        writes.append(('Products', row_idx, stock_col, new_stock))
+                        patches[product_id] = {'Stock': new_stock}
                         if updated_at_col is not None:
-                            stock_updates.append((row_idx, updated_at_col, timestamp))
+                            writes.append(('Products', row_idx, updated_at_col, now_iso))
+                            patches[product_id]['Updated_At'] = now_iso
 
-                        inventory_logs.append([
-                            str(uuid.uuid4())[:8].upper(),
+                        inventory_logs.append(('Inventory_Log', self._inventory_log_row(
                             product_id,
                             "UPDATE",
                             new_stock - previous_stock,
                             previous_stock,
                             new_stock,
-                            timestamp,
-                            f"Order {order_data.get('Order_ID')}"
-                        ])
+                            f"Order {order_data.get('Order_ID')}",
+                            now_iso
+                        )))
 
-                    self._batch_update_cells(products_worksheet, stock_updates)
+            order_row = [
+                order_data.get('Order_ID', ''),
+                order_data.get('Customer_Name', ''),
+                order_data.get('Customer_Phone', ''),
+                order_data.get('Customer_Address', ''),
+                dumps_json(order_data.get('Items', [])),
+                order_data.get('Subtotal', 0),  # Add subtotal
+                order_data.get('Discount_Amount', 0),  # Add discount
+                order_data.get('Delivery_Fee', 0),  # Add delivery fee
+                order_data.get('Total_Amount', 0),
+                order_data.get('Status', 'Completed'),
+                order_data.get('Order_Date', datetime.now().isoformat()),
+                order_data.get('Payment_Method', 'Cash'),
+                order_data.get('Amount_Received', 0)
+            ]
 
-                    if inventory_logs:
-                        inventory_worksheet = self.spreadsheet.worksheet('Inventory_Log')
-                        inventory_worksheet.append_rows(inventory_logs, value_input_option='RAW')
+            self._ws('Orders').append_row(order_row)
+            self.invalidate_orders_cache()
 
-                    self.invalidate_products_cache()
+            if writes:
+                self._apply_mutations(writes, inventory_logs)
+                for product_id, changes in patches.items():
+                    self._patch_cached_product(product_id, changes)
             
             return True
+        except InsufficientStockError:
+            raise
         except Exception as e:
             logger.error(f"Error adding order: {e}")
             return False
 
     def get_products(self, force_refresh: bool = False):
         try:
-            if not force_refresh and self._products_cache_valid():
-                return [dict(product) for product in self._products_cache]
-
-            worksheet = self.spreadsheet.worksheet('Products')
-            all_data = worksheet.get_all_values()
-            if not all_data:
-                return []
-            
-            headers = all_data[0]
-            rows = all_data[1:]
-            
-            records = []
-            for row in rows:
-                if not any(str(cell).strip() for cell in row):
-                    continue
-                record = {}
-                for i, header in enumerate(headers):
-                    header_name = str(header).strip()
-                    if not header_name:
-                        continue
-                    record[header_name] = row[i] if i < len(row) else ''
-                records.append(record)
-            
-            valid_products = []
-            for record in records:
-                name = record.get('Name', '').strip()
-                product_id = record.get('ID', '').strip()
-                
-                if not name or not product_id:
-                    continue
-                
-                try:
-                    record['Price'] = safe_float(record.get('Price', 0))
-                    record['Stock'] = safe_int(record.get('Stock', 0))
-                    import_price_raw = record.get('Import_Price', '')
-                    if import_price_raw in ('', None):
-                        import_price_raw = record.get('Import Price', 0)
-                    record['Import_Price'] = safe_float(import_price_raw, 0)
-                    record['Name'] = name
-                    record['ID'] = product_id
-                    record['Category'] = record.get('Category', 'General').strip()
-                    record['Description'] = record.get('Description', '').strip()
-                    valid_products.append(record)
-                except Exception as e:
-                    continue
-            
-            self._products_cache = [dict(product) for product in valid_products]
-            self._products_cache_at = datetime.utcnow()
-            return [dict(product) for product in valid_products]
+            if force_refresh or not self._products_cache_valid():
+                self._revalidate_sheet_cache('Products', force_refresh)
+            return self._products_cache
         except Exception as e:
             logger.error(f"Error getting products: {e}")
             return []
 
+    def _spreadsheet_modified_time(self):
+        try:
+            return self.spreadsheet.get_lastUpdateTime()
+        except Exception as e:
+            logger.warning(f"Could not read spreadsheet modifiedTime: {e}")
+            return None
+
+    def _revalidate_sheet_cache(self, sheet_name, force_refresh=False):
+        # An expired cache is re-read only if the file's Drive modifiedTime moved since it was loaded.
+        modified_time = None
+        if not force_refresh:
+            modified_time = self._spreadsheet_modified_time()
+            if modified_time is not None and modified_time == self._cache_modified_times.get(sheet_name):
+                expires_at = time.monotonic() + PRODUCT_CACHE_TTL_SECONDS
+                if sheet_name == 'Products':
+                    self._products_cache_expires_at = expires_at
+                else:
+                    self._orders_cache_expires_at = expires_at
+                return
+        self._refresh_sheet_caches(sheet_name, modified_time)
+
+    def _refresh_sheet_caches(self, sheet_name, modified_time=None):
+        # Only a cold start fetches both cached sheets in one values:batchGet. Afterwards each
+        # sheet refreshes alone, so public product reads never pull the growing order history.
+        sheet_names = [sheet_name]
+        if not self._loaded_sheets:
+            sheet_names.append('Orders' if sheet_name == 'Products' else 'Products')
+
+        response = self.spreadsheet.values_batch_get(sheet_names)
+        value_ranges = response.get('valueRanges', [])
+        for idx, name in enumerate(sheet_names):
+            all_data = value_ranges[idx].get('values', []) if idx < len(value_ranges) else []
+            if name == 'Products':
+                self._load_products(all_data)
+            else:
+                self._load_orders(all_data)
+            # modifiedTime was read before the values, so a concurrent edit forces the next reload.
+            self._cache_modified_times[name] = modified_time
+            self._loaded_sheets.add(name)
+
+    def _load_products(self, all_data):
+        # Resolve header positions once, then build and coerce each product in a single pass.
+        headers = [str(header).strip() for header in all_data[0]] if all_data else []
+        header_count = len(headers)
+        columns = [(i, header) for i, header in enumerate(headers) if header]
+        header_positions = {header: i for i, header in columns}
+        id_pos = header_positions.get('ID')
+        name_pos = header_positions.get('Name')
+        price_pos = header_positions.get('Price')
+        stock_pos = header_positions.get('Stock')
+        import_price_pos = header_positions.get('Import_Price')
+        legacy_import_price_pos = header_positions.get('Import Price')
+        to_float = safe_float
+        to_int = safe_int
+
+        valid_products = []
+        product_rows = {}
+        for row_number, row in enumerate(all_data[1:], start=2):
+            if len(row) < header_count:
+                row = row + [''] * (header_count - len(row))
+            product_id = str(row[id_pos]).strip() if id_pos is not None else ''
+            name = str(row[name_pos]).strip() if name_pos is not None else ''
+            if not name or not product_id:
+                continue
+
+            record = {header: row[i] for i, header in columns}
+            try:
+                record['Price'] = to_float(row[price_pos]) if price_pos is not None else 0.0
+                record['Stock'] = to_int(row[stock_pos]) if stock_pos is not None else 0
+                import_price_raw = row[import_price_pos] if import_price_pos is not None else ''
+                if import_price_raw in ('', None) and legacy_import_price_pos is not None:
+                    import_price_raw = row[legacy_import_price_pos]
+                record['Import_Price'] = to_float(import_price_raw, 0.0)
+                record['Name'] = name
+                record['ID'] = product_id
+                record['Category'] = record.get('Category', 'General').strip()
+                record['Description'] = record.get('Description', '').strip()
+                valid_products.append(record)
+                product_rows[product_id] = row_number
+            except Exception as e:
+                continue
+        
+        # Shared snapshot: callers must not mutate the returned products. Updates after a
+        # confirmed write go through _patch_cached_product, which swaps in patched copies.
+        self._products_cache = tuple(valid_products)
+        self._products_by_id = {product['ID']: product for product in valid_products}
+        self._product_positions = {product['ID']: idx for idx, product in enumerate(valid_products)}
+        self._product_rows = product_rows
+        self._products_columns = self._products_columns_for(headers)
+        self._products_headers = headers
+        self._build_products_search_index()
+        self._build_products_stock_index()
+        self._products_cache_at = time.monotonic()
+        self._products_cache_expires_at = self._products_cache_at + PRODUCT_CACHE_TTL_SECONDS
+
+    def get_product_by_id(self, product_id: str, force_refresh: bool = False):
+        self.get_products(force_refresh=force_refresh)
+        return self._products_by_id.get(product_id)
+
     def get_filtered_products(self, query: str = '', category: str = ''):
         normalized_query = str(query or '').strip().lower()
         normalized_category = str(category or '').strip().lower()
@@ -791,29 +1368,23 @@ class GoogleSheetsManager:
         cache_key = (normalized_query, normalized_category)
         cached_entry = self._filtered_products_cache.get(cache_key)
         if cached_entry and cached_entry.get('products_cache_at') == self._products_cache_at:
-            return [dict(item) for item in cached_entry.get('items', [])]
+            return cached_entry.get('items', ())
 
         products = self.get_products()
         if not normalized_query and not normalized_category:
             return products
 
-        filtered = []
-        for product in products:
-            name = str(product.get('Name', ''))
-            product_category = str(product.get('Category', 'General'))
-            description = str(product.get('Description', ''))
-
-            if normalized_query:
-                searchable = f"{name} {product_category} {description}".lower()
-                if normalized_query not in searchable:
-                    continue
-
-            if normalized_category and product_category.lower() != normalized_category:
-                continue
-
-            filtered.append(product)
+        if normalized_query:
+            filtered = [
+                product for product, (_, category_lc, _, joined_lc) in zip(products, self._products_search_index)
+                if normalized_query in joined_lc
+                and (not normalized_category or category_lc == normalized_category)
+            ]
+        else:
+            cached = self._products_cache
+            filtered = [cached[idx] for idx in self._products_by_category.get(normalized_category, ())]
 
-        snapshot = [dict(item) for item in filtered]
+        snapshot = tuple(filtered)
         if cache_key in self._filtered_products_cache:
             self._filtered_products_cache.pop(cache_key, None)
         self._filtered_products_cache[cache_key] = {
@@ -821,41 +1392,38 @@ class GoogleSheetsManager:
             'products_cache_at': self._products_cache_at
         }
         self._prune_filtered_products_cache()
-        return [dict(item) for item in snapshot]
+        return snapshot
     
+    def search_products(self, query: str):
+        products = self.get_products()
+        if not query:
+            return products
+        return [
+            product for product, (name_lc, category_lc, description_lc, _) in zip(products, self._products_search_index)
+            if query in name_lc or query in category_lc or query in description_lc
+        ]
+
+    def get_products_by_category(self, category: str):
+        self.get_products()
+        cached = self._products_cache
+        return [cached[idx] for idx in self._products_by_category.get(str(category).lower(), ())]
+
     def add_product(self, product_data: dict):
         try:
-            worksheet = self.spreadsheet.worksheet('Products')
-            product_data['Created_At'] = datetime.now().isoformat()
-            product_data['Updated_At'] = datetime.now().isoformat()
-
-            headers = [str(h).strip() for h in worksheet.row_values(1)]
+            worksheet = self._ws('Products')
+            now_iso = utc_timestamp()
+            product_data['Created_At'] = now_iso
+            product_data['Updated_At'] = now_iso
+
+            _, headers = self._cached_columns()
+            if not headers and not self._products_cache_valid():
+                # The cache fill failed; check the sheet itself before writing a header row.
+                headers = [str(h).strip() for h in worksheet.row_values(1)]
             if not headers:
                 headers = ['ID', 'Name', 'Price', 'Stock', 'Category', 'Description', 'Created_At', 'Updated_At', 'Import_Price']
                 worksheet.append_row(headers)
 
-            row = []
-            for header in headers:
-                if header in ('Import_Price', 'Import Price'):
-                    row.append(product_data.get('Import_Price', 0))
-                elif header == 'ID':
-                    row.append(product_data.get('ID', ''))
-                elif header == 'Name':
-                    row.append(product_data.get('Name', ''))
-                elif header == 'Price':
-                    row.append(product_data.get('Price', 0))
-                elif header == 'Stock':
-                    row.append(product_data.get('Stock', 0))
-                elif header == 'Category':
-                    row.append(product_data.get('Category', ''))
-                elif header == 'Description':
-                    row.append(product_data.get('Description', ''))
-                elif header == 'Created_At':
-                    row.append(product_data.get('Created_At', ''))
-                elif header == 'Updated_At':
-                    row.append(product_data.get('Updated_At', ''))
-                else:
-                    row.append('')
+            row = [_PRODUCT_COL_EXTRACTORS.get(header, _blank_column)(product_data) for header in headers]
             worksheet.append_row(row)
             self.invalidate_products_cache()
             return True
@@ -865,31 +1433,32 @@ class GoogleSheetsManager:
     
     def update_product_stock(self, product_id: str, new_stock: int, reason: str = "Manual Update"):
         try:
-            worksheet = self.spreadsheet.worksheet('Products')
-            columns, _ = self._get_products_columns(worksheet)
-            id_col = columns.get('id')
+            columns, _ = self._cached_columns()
             stock_col = columns.get('stock')
             updated_at_col = columns.get('updated_at')
-            if id_col is None or stock_col is None:
+            if columns.get('id') is None or stock_col is None:
                 logger.error("Products worksheet is missing ID or Stock column")
                 return False
 
-            id_values = worksheet.col_values(id_col)
-            row_lookup = self._build_row_lookup(id_values)
-            row_idx = row_lookup.get(product_id)
+            # Live Stock so concurrent orders are not overwritten from the cache.
+            row_idx, raw_stock = self._locate_product_row(product_id, columns['id'], stock_col)
             if row_idx is None:
                 return False
 
-            row_data = worksheet.row_values(row_idx)
-            old_stock = safe_int(row_data[stock_col - 1] if len(row_data) >= stock_col else 0)
-            updates = [(row_idx, stock_col, new_stock)]
-            timestamp = datetime.now().isoformat()
+            old_stock = safe_int(raw_stock if raw_stock is not None else 0)
+            timestamp = utc_timestamp()
+            writes = [('Products', row_idx, stock_col, new_stock)]
             if updated_at_col is not None:
-                updates.append((row_idx, updated_at_col, timestamp))
-            self._batch_update_cells(worksheet, updates)
+                writes.append(('Products', row_idx, updated_at_col, timestamp))
+            appends = [('Inventory_Log', self._inventory_log_row(
+                product_id, "UPDATE", new_stock - old_stock, old_stock, new_stock, reason, timestamp
+            ))]
+            self._apply_mutations(writes, appends)
 
-            self.log_inventory_change(product_id, "UPDATE", new_stock - old_stock, old_stock, new_stock, reason)
-            self.invalidate_products_cache()
+            changes = {'Stock': new_stock}
+            if updated_at_col is not None:
+                changes['Updated_At'] = timestamp
+            self._patch_cached_product(product_id, changes)
             return True
         except Exception as e:
             logger.error(f"Error updating product stock: {e}")
@@ -897,33 +1466,33 @@ class GoogleSheetsManager:
     
     def add_stock_to_product(self, product_id: str, stock_to_add: int, reason: str = "Stock Addition"):
         try:
-            worksheet = self.spreadsheet.worksheet('Products')
-            columns, _ = self._get_products_columns(worksheet)
-            id_col = columns.get('id')
+            columns, _ = self._cached_columns()
             stock_col = columns.get('stock')
             updated_at_col = columns.get('updated_at')
-            if id_col is None or stock_col is None:
+            if columns.get('id') is None or stock_col is None:
                 logger.error("Products worksheet is missing ID or Stock column")
                 return False
 
-            id_values = worksheet.col_values(id_col)
-            row_lookup = self._build_row_lookup(id_values)
-            row_idx = row_lookup.get(product_id)
+            # Live Stock so concurrent orders are not overwritten from the cache.
+            row_idx, raw_stock = self._locate_product_row(product_id, columns['id'], stock_col)
             if row_idx is None:
                 return False
 
-            row_data = worksheet.row_values(row_idx)
-            old_stock = safe_int(row_data[stock_col - 1] if len(row_data) >= stock_col else 0)
+            old_stock = safe_int(raw_stock if raw_stock is not None else 0)
             new_stock = old_stock + stock_to_add
-
-            updates = [(row_idx, stock_col, new_stock)]
-            timestamp = datetime.now().isoformat()
+            timestamp = utc_timestamp()
+            writes = [('Products', row_idx, stock_col, new_stock)]
             if updated_at_col is not None:
-                updates.append((row_idx, updated_at_col, timestamp))
-            self._batch_update_cells(worksheet, updates)
+                writes.append(('Products', row_idx, updated_at_col, timestamp))
+            appends = [('Inventory_Log', self._inventory_log_row(
+                product_id, "ADD_STOCK", stock_to_add, old_stock, new_stock, reason, timestamp
+            ))]
+            self._apply_mutations(writes, appends)
 
-            self.log_inventory_change(product_id, "ADD_STOCK", stock_to_add, old_stock, new_stock, reason)
-            self.invalidate_products_cache()
+            changes = {'Stock': new_stock}
+            if updated_at_col is not None:
+                changes['Updated_At'] = timestamp
+            self._patch_cached_product(product_id, changes)
             return True
         except Exception as e:
             logger.error(f"Error adding stock to product: {e}")
@@ -931,9 +1500,7 @@ class GoogleSheetsManager:
     
     def update_product(self, product_id: str, product_data: dict):
         try:
-            worksheet = self.spreadsheet.worksheet('Products')
-            columns, headers = self._get_products_columns(worksheet)
-            id_col = columns.get('id')
+            columns, headers = self._cached_columns()
             name_col = columns.get('name')
             price_col = columns.get('price')
             category_col = columns.get('category')
@@ -941,85 +1508,142 @@ class GoogleSheetsManager:
             import_price_col = columns.get('import_price')
             updated_at_col = columns.get('updated_at')
 
-            if id_col is None:
+            if columns.get('id') is None:
                 logger.error("Products worksheet is missing ID column")
                 return False
 
-            id_values = worksheet.col_values(id_col)
-            row_lookup = self._build_row_lookup(id_values)
-            row_idx = row_lookup.get(product_id)
+            row_idx, _ = self._locate_product_row(product_id, columns['id'])
             if row_idx is None:
                 return False
 
-            updates = []
+            writes = []
+            changes = {}
             if 'name' in product_data and name_col is not None:
-                updates.append((row_idx, name_col, product_data['name']))
+                writes.append(('Products', row_idx, name_col, product_data['name']))
+                changes['Name'] = str(product_data['name']).strip()
             if 'price' in product_data and price_col is not None:
-                updates.append((row_idx, price_col, product_data['price']))
+                writes.append(('Products', row_idx, price_col, product_data['price']))
+                changes['Price'] = safe_float(product_data['price'])
             if 'category' in product_data and category_col is not None:
-                updates.append((row_idx, category_col, product_data['category']))
+                writes.append(('Products', row_idx, category_col, product_data['category']))
+                changes['Category'] = str(product_data['category']).strip()
             if 'description' in product_data and description_col is not None:
-                updates.append((row_idx, description_col, product_data['description']))
+                writes.append(('Products', row_idx, description_col, product_data['description']))
+                changes['Description'] = str(product_data['description']).strip()
             if 'import_price' in product_data:
                 if import_price_col is None:
                     import_price_col = len(headers) + 1
-                    worksheet.update_cell(1, import_price_col, 'Import_Price')
-                updates.append((row_idx, import_price_col, product_data['import_price']))
+                    # The values API grows the grid; updateCells would fail past the last column.
+                    self._ws('Products').update_cell(1, import_price_col, 'Import_Price')
+                    # Only this path changes the header row, so extend the cached layout here.
+                    self._products_headers = headers + ['Import_Price']
+                    self._products_columns = dict(columns, import_price=import_price_col)
+                writes.append(('Products', row_idx, import_price_col, product_data['import_price']))
+                changes['Import_Price'] = safe_float(product_data['import_price'], 0.0)
 
             if updated_at_col is not None:
-                updates.append((row_idx, updated_at_col, datetime.now().isoformat()))
-
-            self._batch_update_cells(worksheet, updates)
-            self.invalidate_products_cache()
+                timestamp = utc_timestamp()
+                writes.append(('Products', row_idx, updated_at_col, timestamp))
+                changes['Updated_At'] = timestamp
+
+            self._apply_mutations(writes)
+            if not changes.get('Name', True):
+                # A blank name drops the row from the catalogue: reload on next read.
+                self.invalidate_products_cache()
+            else:
+                self._patch_cached_product(product_id, changes)
             return True
         except Exception as e:
             logger.error(f"Error updating product: {e}")
             return False
     
-    def log_inventory_change(self, product_id: str, action: str, quantity_change: int, previous_stock: int, new_stock: int, reason: str):
+    def _load_orders(self, all_data):
+        # Single pass: pad, zip, coerce the money columns and parse Order_Date once per row.
+        records = []
+        order_dates = []
+        if all_data:
+            headers = all_data[0]
+            header_count = len(headers)
+            money_columns = ('Subtotal', 'Discount_Amount', 'Delivery_Fee', 'Total_Amount', 'Amount_Received')
+            to_float = safe_float
+            parse_date = parse_order_datetime
+            append_record = records.append
+            append_date = order_dates.append
+            for row in all_data[1:]:
+                if not any(str(cell).strip() for cell in row):
+                    continue
+                if len(row) < header_count:
+                    row = row + [''] * (header_count - len(row))
+                record = dict(zip(headers, row))
+                items_raw = record.get('Items')
+                if type(items_raw) is str and items_raw.startswith('[['):
+                    record['Items'] = self._expand_order_items(items_raw)
+                for header in money_columns:
+                    record[header] = to_float(record.get(header, 0))
+                append_record(record)
+                append_date(parse_date(record.get('Order_Date')) or datetime.min)
+
+        # Shared read-only snapshot, like the products cache; dates run parallel to it.
+        self._orders_cache = tuple(records)
+        self._orders_dates = tuple(order_dates)
+        self._orders_cache_expires_at = time.monotonic() + PRODUCT_CACHE_TTL_SECONDS
+
+    def _expand_order_items(self, items_json):
+        # Orders store [product_id, quantity, unit_price, name] lines; readers get the full line objects back.
         try:
-            worksheet = self.spreadsheet.worksheet('Inventory_Log')
-            log_entry = [
-                str(uuid.uuid4())[:8].upper(),
-                product_id,
-                action,
-                quantity_change,
-                previous_stock,
-                new_stock,
-                datetime.now().isoformat(),
-                reason
-            ]
-            worksheet.append_row(log_entry)
-        except Exception as e:
-            logger.error(f"Error logging inventory change: {e}")
-    
-    def get_orders(self, limit: int = 50):
+            compact_items = json.loads(items_json)
+        except ValueError:
+            return items_json
+
+        items = []
+        for entry in compact_items:
+            if not isinstance(entry, list) or len(entry) < 3:
+                return items_json
+            product_id = str(entry[0])
+            quantity = safe_int(entry[1], 0)
+            unit_price = safe_float(entry[2], 0.0)
+            items.append({
+                'product_id': product_id,
+                'name': str(entry[3]) if len(entry) > 3 else product_id,
+                'unit_price': unit_price,
+                'quantity': quantity,
+                'total_price': cart_line_total(unit_price, quantity)
+            })
+        return dumps_json(items)
+
+    def get_orders_with_dates(self, limit: int = 50):
+        """Newest orders paired with their Order_Date parsed at cache fill (datetime.min if unparseable)."""
         try:
-            worksheet = self.spreadsheet.worksheet('Orders')
-            records = worksheet.get_all_records()
-            for record in records:
-                record['Subtotal'] = safe_float(record.get('Subtotal', 0))
-                record['Discount_Amount'] = safe_float(record.get('Discount_Amount', 0))
-                record['Delivery_Fee'] = safe_float(record.get('Delivery_Fee', 0))
-                record['Total_Amount'] = safe_float(record.get('Total_Amount', 0))
-                record['Amount_Received'] = safe_float(record.get('Amount_Received', 0))
-
-            records.sort(
-                key=lambda order: parse_order_datetime(order.get('Order_Date')) or datetime.min,
-                reverse=True
-            )
-            return records[:limit] if len(records) > limit else records
+            if not self._orders_cache_valid():
+                self._revalidate_sheet_cache('Orders')
+
+            records = self._orders_cache
+            order_dates = self._orders_dates
+            # Newest first without sorting the whole sheet; ties keep sheet order like a stable sort.
+            newest = heapq.nlargest(limit, range(len(records)), key=order_dates.__getitem__)
+            return [(records[idx], order_dates[idx]) for idx in newest]
         except Exception as e:
             logger.error(f"Error getting orders: {e}")
             return []
+
+    def get_orders(self, limit: int = 50):
+        return [order for order, _ in self.get_orders_with_dates(limit)]
     
-    def get_low_stock_products(self, threshold: int = 10):
-        products = self.get_products()
-        return [p for p in products if p['Stock'] <= threshold]
+    def get_low_stock_products(self, threshold: int = 10, products=None):
+        # The stock index covers the current cached snapshot only (the default call, and
+        # get_analytics passing that snapshot); any other list is filtered linearly.
+        if products is None:
+            products = self.get_products()
+        if products is not self._products_cache:
+            return [p for p in products if p['Stock'] <= threshold]
+        count = bisect.bisect_right(self._products_stock_index, (threshold, math.inf))
+        # Back to sheet order, as callers have always received it.
+        positions = sorted(position for _, position in self._products_stock_index[:count])
+        return [products[position] for position in positions]
     
     def get_inventory_log(self, limit: int = 100):
         try:
-            worksheet = self.spreadsheet.worksheet('Inventory_Log')
+            worksheet = self._ws('Inventory_Log')
             records = worksheet.get_all_records()
             return records[-limit:] if len(records) > limit else records
         except Exception as e:
@@ -1080,7 +1704,7 @@ def admin_login():
             return render_template('admin_login.html')
 
         password = request.form.get('password', '')
-        if password == ADMIN_PASSWORD:
+        if check_password_hash(ADMIN_PASSWORD_HASH, password):
             session['is_admin'] = True
             session.pop('admin_login_attempts', None)
             session.pop('admin_lock_until', None)
@@ -1138,20 +1762,7 @@ def get_products_lazy():
 @app.route('/api/products/search')
 def search_products():
     query = request.args.get('q', '').lower()
-    products = sheets_manager.get_products()
-    
-    if not query:
-        return jsonify(products)
-    
-    filtered = []
-    for product in products:
-        name = str(product.get('Name', '')).lower()
-        category = str(product.get('Category', '')).lower()
-        description = str(product.get('Description', '')).lower()
-        if query in name or query in category or query in description:
-            filtered.append(product)
-    
-    return jsonify(filtered)
+    return jsonify(sheets_manager.search_products(query))
 
 @app.route('/api/categories')
 def get_categories():
@@ -1166,10 +1777,7 @@ def get_categories():
 
 @app.route('/api/products/category/<category>')
 def get_products_by_category(category):
-    products = sheets_manager.get_products()
-    category_lower = category.lower()
-    filtered = [p for p in products if str(p.get('Category', 'General')).lower() == category_lower]
-    return jsonify(filtered)
+    return jsonify(sheets_manager.get_products_by_category(category))
 
 @app.route('/api/cart')
 def get_cart():
@@ -1187,8 +1795,7 @@ def add_to_cart():
     if quantity <= 0 or quantity > MAX_CART_ITEM_QUANTITY:
         return api_error('Invalid quantity', 400)
 
-    products = sheets_manager.get_products()
-    product = next((p for p in products if p['ID'] == product_id), None)
+    product = sheets_manager.get_product_by_id(product_id)
 
     if not product:
         return api_error('Product not found', 404)
@@ -1205,7 +1812,7 @@ def add_to_cart():
             return api_error('Insufficient stock for total quantity', 409)
         existing_item['quantity'] = new_quantity
         existing_item['unit_price'] = safe_float(product.get('Price'), existing_item['unit_price'])
-        existing_item['total_price'] = round(existing_item['quantity'] * existing_item['unit_price'], 2)
+        existing_item['total_price'] = cart_line_total(existing_item['unit_price'], existing_item['quantity'])
         existing_item['name'] = product.get('Name', existing_item['name'])
     else:
         cart_item = {
@@ -1213,7 +1820,7 @@ def add_to_cart():
             'name': product.get('Name', ''),
             'unit_price': safe_float(product.get('Price'), 0.0),
             'quantity': quantity,
-            'total_price': round(safe_float(product.get('Price'), 0.0) * quantity, 2)
+            'total_price': cart_line_total(safe_float(product.get('Price'), 0.0), quantity)
         }
         cart.append(cart_item)
 
@@ -1242,8 +1849,7 @@ def update_cart():
     if quantity > MAX_CART_ITEM_QUANTITY:
         return api_error('Quantity too large', 400)
 
-    products = sheets_manager.get_products()
-    product = next((p for p in products if p['ID'] == product_id), None)
+    product = sheets_manager.get_product_by_id(product_id)
     if not product:
         return api_error('Product not found', 404)
     if product['Stock'] < quantity:
@@ -1252,7 +1858,7 @@ def update_cart():
     item['quantity'] = quantity
     item['unit_price'] = safe_float(product.get('Price'), item['unit_price'])
     item['name'] = product.get('Name', item['name'])
-    item['total_price'] = round(item['quantity'] * item['unit_price'], 2)
+    item['total_price'] = cart_line_total(item['unit_price'], item['quantity'])
 
     save_session_cart(cart)
     return jsonify({'success': True, 'cart': cart})
@@ -1288,25 +1894,32 @@ def checkout():
     amount_received = max(0.0, safe_float(data.get('amount_received'), 0.0))
     print_size = str(data.get('print_size', '80mm')).strip()
 
-    valid_payment_methods = {'Cash', 'Card', 'Digital'}
-    if payment_method not in valid_payment_methods:
+    if payment_method not in VALID_PAYMENT_METHODS:
         payment_method = 'Cash'
 
-    valid_print_sizes = {'80mm', '100mm', 'A4', 'A5', 'letter'}
-    if print_size not in valid_print_sizes:
+    if print_size not in VALID_PRINT_SIZES:
         print_size = '80mm'
 
-    products = sheets_manager.get_products(force_refresh=True)
-    product_map = {product['ID']: product for product in products}
-    for item in cart:
-        product = product_map.get(item['product_id'])
-        if not product:
-            return api_error(f"Product {item['product_id']} no longer exists", 404)
-        if safe_int(product.get('Stock'), 0) < item['quantity']:
-            return api_error(f"Insufficient stock for {product.get('Name', item['product_id'])}", 409)
-
-    order_id = f"ORD-{datetime.now().strftime('%Y%m%d')}-{str(uuid.uuid4())[:8].upper()}"
-    subtotal = sum(safe_float(item.get('total_price'), 0.0) for item in cart)
+    def stock_error():
+        for item in cart:
+            product = sheets_manager.get_product_by_id(item['product_id'])
+            if not product:
+                return api_error(f"Product {item['product_id']} no longer exists", 404)
+            if safe_int(product.get('Stock'), 0) < item['quantity']:
+                return api_error(f"Insufficient stock for {product.get('Name', item['product_id'])}", 409)
+        return None
+
+    # Validate against the cached snapshot; only a failure pays for a fresh read before rejecting.
+    # add_order re-checks the live Stock column and raises InsufficientStockError (409 below) on a shortfall.
+    if stock_error() is not None:
+        sheets_manager.get_products(force_refresh=True)
+        error_response = stock_error()
+        if error_response is not None:
+            return error_response
+
+    order_id = f"ORD-{order_day_stamp()}-{short_id()}"
+    # get_session_cart() already coerced every total_price to a float.
+    subtotal = math.fsum(item['total_price'] for item in cart)
     final_total = max(0, subtotal - discount_amount + delivery_fee)
 
     # Validate payment amount for cash transactions
@@ -1318,7 +1931,8 @@ def checkout():
         'Customer_Name': customer_name,
         'Customer_Phone': customer_phone,
         'Customer_Address': customer_address,
-        'Items': cart.copy(),  # Make a copy to preserve original cart data
+        # The name is kept so past orders read the same after a product is renamed or removed.
+        'Items': [[item['product_id'], item['quantity'], item['unit_price'], item['name']] for item in cart],
         'Subtotal': subtotal,
         'Discount_Amount': discount_amount,
         'Delivery_Fee': delivery_fee,
@@ -1330,7 +1944,11 @@ def checkout():
         'Print_Size': print_size
     }
     
-    success = sheets_manager.add_order(order_data)
+    try:
+        success = sheets_manager.add_order(order_data)
+    except InsufficientStockError as e:
+        # The cached snapshot passed but the live sheet did not: report the conflict, write nothing.
+        return api_error(f"Insufficient stock for {e.product_name}", 409, available=e.available)
 
     if success:
         save_session_cart([])
@@ -1356,50 +1974,43 @@ def email_invoice():
         if not recipient_email or '@' not in recipient_email:
             return api_error('Valid recipient email is required', 400)
 
-        safe_message_body = html.escape(message_body)
+        # Reject malformed payloads here; the worker only sees data it can render.
+        items = order_data.get('items', []) if isinstance(order_data, dict) else None
+        if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+            return api_error('Invalid order data', 400)
+        if not isinstance(company_info, dict):
+            return api_error('Invalid company info', 400)
+
+        # Rendering and SMTP happen on the mail worker; poll the job for the delivery outcome.
+        job_id = secrets.token_hex(8)
+        _set_email_job_status(job_id, 'queued')
+        _email_executor.submit(
+            _send_invoice_email, job_id, recipient_email, subject, message_body, order_data, company_info
+        )
         
-        # Generate invoice HTML
-        invoice_html = generate_invoice_html(order_data, company_info)
-        
-        # Create email
-        msg = MIMEMultipart('alternative')
-        msg['From'] = EMAIL_ADDRESS
-        msg['To'] = recipient_email
-        msg['Subject'] = subject
-        
-        # Create text and HTML parts
-        text_part = MIMEText(message_body, 'plain')
-        html_part = MIMEText(f"""
-        <html>
-        <body>
-            <p>{safe_message_body.replace(chr(10), '<br>')}</p>
-            <hr>
-            {invoice_html}
-        </body>
-        </html>
-        """, 'html')
-        
-        msg.attach(text_part)
-        msg.attach(html_part)
-        
-        # Create and attach PDF if possible (optional - requires additional libraries)
-        # For now, we'll just send the HTML email
-        
-        # Send email
-        server = smtplib.SMTP(SMTP_SERVER, SMTP_PORT)
-        server.starttls()
-        server.login(EMAIL_ADDRESS, EMAIL_PASSWORD)
-        
-        text = msg.as_string()
-        server.sendmail(EMAIL_ADDRESS, recipient_email, text)
-        server.quit()
-        
-        return jsonify({'success': True, 'message': 'Invoice sent successfully'})
+        return jsonify({
+            'success': True,
+            'job_id': job_id,
+            'status': 'queued',
+            'message': 'Invoice queued for sending'
+        }), 202
         
     except Exception as e:
-        logger.error(f"Error sending email: {e}")
+        logger.error(f"Error queueing email: {e}")
         return api_error('Failed to send email', 500)
 
+@app.route('/api/email-invoice/<job_id>')
+def email_invoice_status(job_id):
+    status = get_email_job_status(job_id)
+    if status is None:
+        return api_error('Unknown email job', 404)
+    messages = {
+        'queued': 'Invoice queued for sending',
+        'sent': 'Invoice sent successfully',
+        'failed': 'Failed to send email'
+    }
+    return jsonify({'success': True, 'job_id': job_id, 'status': status, 'message': messages[status]})
+
 @app.route('/api/admin/products/add', methods=['POST'])
 @require_admin
 def add_product():
@@ -1410,7 +2021,7 @@ def add_product():
         return api_error(error_msg, 400)
     
     product_data = {
-        'ID': str(uuid.uuid4())[:8].upper(),
+        'ID': short_id(),
         'Name': str(data.get('name', '')).strip(),
         'Price': safe_float(data.get('price'), 0.0),
         'Stock': safe_int(data.get('stock'), 0),
@@ -1508,46 +2119,47 @@ def get_orders():
 @app.route('/api/admin/analytics')
 @require_admin
 def get_analytics():
-    orders = sheets_manager.get_orders()
+    dated_orders = sheets_manager.get_orders_with_dates()
     products = sheets_manager.get_products()
     
     now = datetime.now()
     today_date = now.date()
     week_ago = now - timedelta(days=7)
 
-    today_orders = []
-    week_orders = []
-    for order in orders:
-        order_dt = parse_order_datetime(order.get('Order_Date'))
-        if order_dt is None:
-            continue
+    # One pass over orders and one over products; counts and revenue accumulate together.
+    today_count = week_count = 0
+    today_revenue = week_revenue = total_revenue = 0.0
+    for order, order_dt in dated_orders:
+        amount = safe_float(order.get('Total_Amount', 0))
+        total_revenue += amount
         if order_dt.date() == today_date:
-            today_orders.append(order)
+            today_count += 1
+            today_revenue += amount
         if order_dt >= week_ago:
-            week_orders.append(order)
-    
-    today_revenue = sum(safe_float(o.get('Total_Amount', 0)) for o in today_orders)
-    week_revenue = sum(safe_float(o.get('Total_Amount', 0)) for o in week_orders)
-    total_revenue = sum(safe_float(o.get('Total_Amount', 0)) for o in orders)
+            week_count += 1
+            week_revenue += amount
 
     total_stock_units = 0
     inventory_investment = 0.0
     for product in products:
-        stock = max(0, safe_int(product.get('Stock', 0)))
-        import_price = max(0.0, safe_float(product.get('Import_Price', 0)))
+        stock = product['Stock']
+        if stock <= 0:
+            continue
+        import_price = product['Import_Price']
         total_stock_units += stock
-        inventory_investment += stock * import_price
+        if import_price > 0:
+            inventory_investment += stock * import_price
     
-    low_stock = sheets_manager.get_low_stock_products()
+    low_stock = sheets_manager.get_low_stock_products(products=products)
     
     analytics = {
-        'total_orders': len(orders),
-        'today_orders': len(today_orders),
-        'week_orders': len(week_orders),
+        'total_orders': len(dated_orders),
+        'today_orders': today_count,
+        'week_orders': week_count,
         'today_revenue': today_revenue,
         'week_revenue': week_revenue,
         'total_revenue': total_revenue,
-        'avg_order_value': total_revenue / len(orders) if orders else 0,
+        'avg_order_value': total_revenue / len(dated_orders) if dated_orders else 0,
         'total_products': len(products),
         'total_stock_units': total_stock_units,
         'inventory_investment': round(inventory_investment, 2),
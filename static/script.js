@@ -2076,9 +2076,12 @@ generateInvoiceHTML() {
             const result = await response.json();
 
             if (result.success) {
-                this.showNotification('Invoice sent successfully!', 'success');
+                this.showNotification(result.message || 'Invoice queued for sending', 'info');
                 this.closeModal(document.getElementById('email-modal'));
                 document.getElementById('email-form').reset();
+                if (result.job_id) {
+                    this.pollEmailJob(result.job_id);
+                }
             } else {
                 this.showNotification(result.message || 'Failed to send email', 'error');
             }
@@ -2091,6 +2094,33 @@ generateInvoiceHTML() {
         }
     }
 
+    async pollEmailJob(jobId, attempts = 15) {
+        // Delivery happens in the background; report the real outcome once it is known.
+        for (let attempt = 0; attempt < attempts; attempt++) {
+            await new Promise(resolve => setTimeout(resolve, 2000));
+            try {
+                const response = await fetch(`/api/email-invoice/${encodeURIComponent(jobId)}`);
+                if (response.status === 404) {
+                    // Job status is per worker; another worker may be the one sending it.
+                    this.showNotification('Invoice queued; delivery status is not available', 'info');
+                    return;
+                }
+                const result = await response.json();
+                if (result.status === 'sent') {
+                    this.showNotification('Invoice sent successfully!', 'success');
+                    return;
+                }
+                if (result.status === 'failed' || !result.success) {
+                    this.showNotification(result.message || 'Failed to send email', 'error');
+                    return;
+                }
+            } catch (error) {
+                console.error('Error checking email status:', error);
+            }
+        }
+        this.showNotification('Invoice email is still being sent', 'warning');
+    }
+
     syncOfflineData() {
         console.log('Syncing offline data...');
     }